@@ -3,6 +3,151 @@ Central configuration – reads from environment variables with sensible default
 """
 
 import os
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# Immutable lookup tables, importable directly by hot paths; also exposed
+# on `Settings` for existing callers.
+
+# Real-world heights (metres) for all 80 COCO classes detected by YOLOv8n.
+# Values represent the dominant visible vertical dimension of each object.
+KNOWN_HEIGHTS: Mapping[str, float] = MappingProxyType({
+    # ── People & Riding ──────────────────────────────────────────────────
+    "person":           1.7,   # average adult standing height
+    "bicycle":          1.0,   # handlebar height
+    "motorcycle":       1.1,   # seat + handlebar height
+    "skateboard":       0.15,  # deck-to-ground height (ground-level hazard)
+    "surfboard":        1.8,   # board length (usually propped upright)
+    "skis":             1.6,   # ski length (upright)
+    "snowboard":        1.4,   # board length (upright)
+
+    # ── Vehicles ─────────────────────────────────────────────────────────
+    "car":              1.5,   # roof height
+    "truck":            3.0,   # cab roof height
+    "bus":              3.2,   # full vehicle height
+    "train":            3.5,   # carriage height
+    "airplane":         5.0,   # fuselage height (ground level)
+    "boat":             2.0,   # typical small vessel freeboard + deckhouse
+
+    # ── Traffic Infrastructure ───────────────────────────────────────────
+    "traffic light":    0.6,   # signal head box height
+    "fire hydrant":     0.6,   # hydrant body height
+    "stop sign":        0.75,  # sign panel height
+    "parking meter":    1.2,   # meter post height
+
+    # ── Outdoor Furniture & Fixtures ─────────────────────────────────────
+    "bench":            0.5,   # seat height
+
+    # ── Animals ──────────────────────────────────────────────────────────
+    "bird":             0.2,   # small-to-medium bird (e.g. pigeon, crow)
+    "cat":              0.3,   # shoulder height
+    "dog":              0.5,   # shoulder height (medium breed average)
+    "horse":            1.6,   # wither height
+    "sheep":            0.9,   # shoulder height
+    "cow":              1.4,   # shoulder height
+    "elephant":         3.0,   # shoulder height
+    "bear":             1.2,   # shoulder height (standing ~2 m; use shoulder)
+    "zebra":            1.5,   # shoulder height
+    "giraffe":          5.0,   # full height
+
+    # ── Accessories & Bags ───────────────────────────────────────────────
+    "backpack":         0.45,  # bag height (worn or on ground)
+    "umbrella":         0.9,   # folded/closed length
+    "handbag":          0.3,   # bag height
+    "tie":              1.4,   # knot-to-tip length (hanging)
+    "suitcase":         0.7,   # upright suitcase height
+
+    # ── Sports Equipment ─────────────────────────────────────────────────
+    "frisbee":          0.27,  # diameter
+    "sports ball":      0.22,  # average (soccer ball ≈ 22 cm diameter)
+    "kite":             0.8,   # approximate visible height when airborne
+    "baseball bat":     0.85,  # length
+    "baseball glove":   0.25,  # glove height
+    "tennis racket":    0.68,  # racket length
+
+    # ── Food & Kitchen (close-range, indoor use) ─────────────────────────
+    "bottle":           0.25,  # typical water/beverage bottle
+    "wine glass":       0.22,  # glass height
+    "cup":              0.15,  # mug/cup height
+    "fork":             0.20,  # fork length
+    "knife":            0.25,  # kitchen knife length
+    "spoon":            0.18,  # spoon length
+    "bowl":             0.10,  # bowl height
+    "banana":           0.18,  # banana length
+    "apple":            0.08,  # apple diameter
+    "sandwich":         0.12,  # sandwich height
+    "orange":           0.08,  # orange diameter
+    "broccoli":         0.20,  # head height
+    "carrot":           0.18,  # carrot length
+    "hot dog":          0.15,  # hot dog length
+    "pizza":            0.30,  # pizza diameter (single slice ~0.15 m)
+    "donut":            0.10,  # donut diameter
+    "cake":             0.15,  # cake height
+
+    # ── Indoor Furniture ─────────────────────────────────────────────────
+    "chair":            0.90,  # seat-back height
+    "couch":            0.85,  # seat-back height
+    "potted plant":     0.40,  # average indoor plant height
+    "bed":              0.60,  # mattress + frame height
+    "dining table":     0.75,  # table surface height
+    "toilet":           0.40,  # bowl height
+    "tv":               0.60,  # screen height (40–55 inch typical)
+    "laptop":           0.30,  # open-lid height
+    "mouse":            0.04,  # mouse body height
+    "remote":           0.18,  # remote length
+    "keyboard":         0.03,  # keyboard thickness (keycap height)
+    "cell phone":       0.15,  # phone height
+    "microwave":        0.30,  # oven height
+    "oven":             0.90,  # full oven height
+    "toaster":          0.20,  # toaster height
+    "sink":             0.50,  # basin depth / mounting height
+    "refrigerator":     1.80,  # fridge height
+    "clock":            0.30,  # wall-clock diameter
+    "vase":             0.30,  # vase height
+    "scissors":         0.18,  # scissors length
+    "teddy bear":       0.30,  # stuffed toy height
+    "hair drier":       0.25,  # dryer length
+    "toothbrush":       0.18,  # toothbrush length
+    "book":             0.25,  # book height (A5)
+})
+
+# ── Priority tiers for the safety engine ─────────────────────────────────
+# Tier 1: Imminent physical danger – always surfaces as the priority object.
+CRITICAL_OBJECTS: frozenset[str] = frozenset({
+    # Moving vehicles (collision hazard)
+    "car", "truck", "bus", "motorcycle", "bicycle", "train",
+    # Traffic infrastructure (navigation hazard)
+    "traffic light", "stop sign", "fire hydrant", "parking meter",
+    # Living beings that can move unpredictably
+    "person", "dog", "horse", "cow", "elephant", "bear",
+    # Handheld weapons / sharp objects
+    "knife", "scissors", "baseball bat",
+})
+
+# Tier 2: Trip / collision hazard – elevated priority when very close.
+HAZARD_OBJECTS: frozenset[str] = frozenset({
+    "bench", "potted plant", "suitcase", "backpack",
+    "skateboard", "sports ball", "bird", "cat", "sheep", "zebra",
+    "couch", "chair", "dining table",
+})
+
+# Classes whose distance matters for navigation. MiDaS only runs when one
+# of these needs a depth estimate; frames with only other classes (e.g.
+# currency, tabletop items) get pinhole distances or 0.0.
+DEPTH_RELEVANT_LABELS: frozenset[str] = CRITICAL_OBJECTS | HAZARD_OBJECTS | frozenset({
+    # Crossings / signals from the custom model
+    "crosswalk", "greenlight", "redlight",
+    # Pose classes from the custom model (all people)
+    "standing", "walking", "sitting", "falling", "Fall-Detected", "Sit Down",
+    # Large indoor obstacles
+    "bed", "refrigerator", "oven", "sink", "toilet", "tv",
+    # Large animals not already in a tier
+    "giraffe",
+})
+
+# Bit flags for the detector's per-class safety tier table
+TIER_CRITICAL = 1
+TIER_HAZARD = 2
 
 
 class Settings:
@@ -10,138 +155,54 @@ class Settings:
     YOLO_MODEL_PATH: str = os.getenv("YOLO_MODEL_PATH", "models/yolov8n.pt")
     ZERO_DCE_MODEL_PATH: str = os.getenv("ZERO_DCE_MODEL_PATH", "models/zero_dce_model.h5")
     MIDAS_MODEL_TYPE: str = os.getenv("MIDAS_MODEL_TYPE", "MiDaS_small")
+    # Optional ONNX export of the MiDaS model, run with ONNX Runtime
+    # (TensorRT FP16 → CUDA → CPU); empty = PyTorch Hub model
+    MIDAS_ONNX_PATH: str = os.getenv("MIDAS_ONNX_PATH", "")
 
     # Processing
     IMAGE_SIZE: int = int(os.getenv("IMAGE_SIZE", "640"))
     CONFIDENCE_THRESHOLD: float = float(os.getenv("CONFIDENCE_THRESHOLD", "0.25"))
     LOW_LIGHT_THRESHOLD: float = float(os.getenv("LOW_LIGHT_THRESHOLD", "0.15"))
+    # Threads running model inference off the event loop (per process);
+    # the batcher keeps up to this many batches in flight
+    INFERENCE_WORKERS: int = int(os.getenv("INFERENCE_WORKERS", "1"))
+    # Uploads up to this size stay in memory instead of spooling to disk
+    UPLOAD_SPOOL_BYTES: int = int(os.getenv("UPLOAD_SPOOL_BYTES", str(8 * 1024 * 1024)))
+    # Reuse a client's previous result when its next frame is near-identical
+    # (average-hash distance ≤ FRAME_CACHE_MAX_DISTANCE bits) and younger
+    # than FRAME_CACHE_TTL_MS; 0 disables the cache. Only requests carrying
+    # an X-Client-Id header are cached
+    FRAME_CACHE_TTL_MS: float = float(os.getenv("FRAME_CACHE_TTL_MS", "200"))
+    FRAME_CACHE_MAX_DISTANCE: int = int(os.getenv("FRAME_CACHE_MAX_DISTANCE", "4"))
+    # Micro-batching: concurrent frames are grouped into one model pass of
+    # up to MAX_BATCH, waiting at most BATCH_TIMEOUT_MS for the batch to fill
+    MAX_BATCH: int = int(os.getenv("MAX_BATCH", "4"))
+    BATCH_TIMEOUT_MS: float = float(os.getenv("BATCH_TIMEOUT_MS", "10"))
+    # Load and warm up all models in the background right after startup
+    PRELOAD_MODELS: bool = os.getenv("PRELOAD_MODELS", "true").lower() == "true"
 
     # Distance calibration (approximate focal-length based)
     # Reference focal length at 640px image height; auto-scaled for other resolutions
     # Formula: distance (m) = KNOWN_HEIGHT (m) * FOCAL_LENGTH_PX / bbox_height_px
     FOCAL_LENGTH_PX: float = float(os.getenv("FOCAL_LENGTH_PX", "600.0"))
 
-    # Real-world heights (metres) for all 80 COCO classes detected by YOLOv8n.
-    # Values represent the dominant visible vertical dimension of each object.
-    KNOWN_HEIGHTS: dict = {
-        # ── People & Riding ──────────────────────────────────────────────────
-        "person":           1.7,   # average adult standing height
-        "bicycle":          1.0,   # handlebar height
-        "motorcycle":       1.1,   # seat + handlebar height
-        "skateboard":       0.15,  # deck-to-ground height (ground-level hazard)
-        "surfboard":        1.8,   # board length (usually propped upright)
-        "skis":             1.6,   # ski length (upright)
-        "snowboard":        1.4,   # board length (upright)
-
-        # ── Vehicles ─────────────────────────────────────────────────────────
-        "car":              1.5,   # roof height
-        "truck":            3.0,   # cab roof height
-        "bus":              3.2,   # full vehicle height
-        "train":            3.5,   # carriage height
-        "airplane":         5.0,   # fuselage height (ground level)
-        "boat":             2.0,   # typical small vessel freeboard + deckhouse
-
-        # ── Traffic Infrastructure ───────────────────────────────────────────
-        "traffic light":    0.6,   # signal head box height
-        "fire hydrant":     0.6,   # hydrant body height
-        "stop sign":        0.75,  # sign panel height
-        "parking meter":    1.2,   # meter post height
-
-        # ── Outdoor Furniture & Fixtures ─────────────────────────────────────
-        "bench":            0.5,   # seat height
-
-        # ── Animals ──────────────────────────────────────────────────────────
-        "bird":             0.2,   # small-to-medium bird (e.g. pigeon, crow)
-        "cat":              0.3,   # shoulder height
-        "dog":              0.5,   # shoulder height (medium breed average)
-        "horse":            1.6,   # wither height
-        "sheep":            0.9,   # shoulder height
-        "cow":              1.4,   # shoulder height
-        "elephant":         3.0,   # shoulder height
-        "bear":             1.2,   # shoulder height (standing ~2 m; use shoulder)
-        "zebra":            1.5,   # shoulder height
-        "giraffe":          5.0,   # full height
-
-        # ── Accessories & Bags ───────────────────────────────────────────────
-        "backpack":         0.45,  # bag height (worn or on ground)
-        "umbrella":         0.9,   # folded/closed length
-        "handbag":          0.3,   # bag height
-        "tie":              1.4,   # knot-to-tip length (hanging)
-        "suitcase":         0.7,   # upright suitcase height
-
-        # ── Sports Equipment ─────────────────────────────────────────────────
-        "frisbee":          0.27,  # diameter
-        "sports ball":      0.22,  # average (soccer ball ≈ 22 cm diameter)
-        "kite":             0.8,   # approximate visible height when airborne
-        "baseball bat":     0.85,  # length
-        "baseball glove":   0.25,  # glove height
-        "tennis racket":    0.68,  # racket length
-
-        # ── Food & Kitchen (close-range, indoor use) ─────────────────────────
-        "bottle":           0.25,  # typical water/beverage bottle
-        "wine glass":       0.22,  # glass height
-        "cup":              0.15,  # mug/cup height
-        "fork":             0.20,  # fork length
-        "knife":            0.25,  # kitchen knife length
-        "spoon":            0.18,  # spoon length
-        "bowl":             0.10,  # bowl height
-        "banana":           0.18,  # banana length
-        "apple":            0.08,  # apple diameter
-        "sandwich":         0.12,  # sandwich height
-        "orange":           0.08,  # orange diameter
-        "broccoli":         0.20,  # head height
-        "carrot":           0.18,  # carrot length
-        "hot dog":          0.15,  # hot dog length
-        "pizza":            0.30,  # pizza diameter (single slice ~0.15 m)
-        "donut":            0.10,  # donut diameter
-        "cake":             0.15,  # cake height
-
-        # ── Indoor Furniture ─────────────────────────────────────────────────
-        "chair":            0.90,  # seat-back height
-        "couch":            0.85,  # seat-back height
-        "potted plant":     0.40,  # average indoor plant height
-        "bed":              0.60,  # mattress + frame height
-        "dining table":     0.75,  # table surface height
-        "toilet":           0.40,  # bowl height
-        "tv":               0.60,  # screen height (40–55 inch typical)
-        "laptop":           0.30,  # open-lid height
-        "mouse":            0.04,  # mouse body height
-        "remote":           0.18,  # remote length
-        "keyboard":         0.03,  # keyboard thickness (keycap height)
-        "cell phone":       0.15,  # phone height
-        "microwave":        0.30,  # oven height
-        "oven":             0.90,  # full oven height
-        "toaster":          0.20,  # toaster height
-        "sink":             0.50,  # basin depth / mounting height
-        "refrigerator":     1.80,  # fridge height
-        "clock":            0.30,  # wall-clock diameter
-        "vase":             0.30,  # vase height
-        "scissors":         0.18,  # scissors length
-        "teddy bear":       0.30,  # stuffed toy height
-        "hair drier":       0.25,  # dryer length
-        "toothbrush":       0.18,  # toothbrush length
-        "book":             0.25,  # book height (A5)
-    }
+    # Depth-map bbox statistic: O(1) integral-image mean by default;
+    # set to "true" to use the exact per-region median (debugging only)
+    DEPTH_USE_MEDIAN: bool = os.getenv("DEPTH_USE_MEDIAN", "false").lower() == "true"
 
-    # ── Priority tiers for the safety engine ─────────────────────────────────
-    # Tier 1: Imminent physical danger – always surfaces as the priority object.
-    CRITICAL_OBJECTS: set = {
-        # Moving vehicles (collision hazard)
-        "car", "truck", "bus", "motorcycle", "bicycle", "train",
-        # Traffic infrastructure (navigation hazard)
-        "traffic light", "stop sign", "fire hydrant", "parking meter",
-        # Living beings that can move unpredictably
-        "person", "dog", "horse", "cow", "elephant", "bear",
-        # Handheld weapons / sharp objects
-        "knife", "scissors", "baseball bat",
-    }
+    # Skip the MiDaS pass when every detection has a known height and
+    # report pinhole-only distances for that frame
+    DEPTH_SKIP_KNOWN_HEIGHTS: bool = os.getenv("DEPTH_SKIP_KNOWN_HEIGHTS", "true").lower() == "true"
 
-    # Tier 2: Trip / collision hazard – elevated priority when very close.
-    HAZARD_OBJECTS: set = {
-        "bench", "potted plant", "suitcase", "backpack",
-        "skateboard", "sports ball", "bird", "cat", "sheep", "zebra",
-        "couch", "chair", "dining table",
-    }
+    # On CUDA, run MiDaS on every frame concurrently with YOLO (separate
+    # streams) instead of only after YOLO says depth is needed: lower
+    # latency, but the depth gates above no longer save any GPU work
+    DEPTH_OVERLAP_STREAMS: bool = os.getenv("DEPTH_OVERLAP_STREAMS", "false").lower() == "true"
+
+    KNOWN_HEIGHTS: Mapping[str, float] = KNOWN_HEIGHTS
+    CRITICAL_OBJECTS: frozenset[str] = CRITICAL_OBJECTS
+    HAZARD_OBJECTS: frozenset[str] = HAZARD_OBJECTS
+    DEPTH_RELEVANT_LABELS: frozenset[str] = DEPTH_RELEVANT_LABELS
 
     # Distance thresholds (metres)
     DISTANCE_VERY_CLOSE: float = 1.0   # strong haptic + urgent voice
@@ -12,10 +12,13 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.formparsers import MultiPartParser
 
 from app.config import settings
+from app.models.batcher import InferenceBatcher
 from app.models.model_manager import ModelManager
 from app.routers import analyze, health
+from app.services.frame_cache import FrameCache
 
 logger = logging.getLogger("eyes")
 logging.basicConfig(
@@ -23,17 +26,40 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(name)s – %(message)s",
 )
 
+# Keep typical 2–4 MB camera frames in memory (Starlette's default is 1 MB)
+MultiPartParser.max_file_size = settings.UPLOAD_SPOOL_BYTES
+
+
+def _log_preload_failure(future):
+    exc = future.exception()
+    if exc is not None:
+        logger.error(f"Model preload failed: {exc}. Models will load on first request.")
+
 
 @asynccontextmanager
 async def lifespan(application: FastAPI):
-    """Initialize model manager (lazy loading on first request)."""
+    """Initialize the shared model manager (lazy loading on first request)."""
     logger.info("Initializing model manager (lazy loading enabled)")
-    manager = ModelManager()
+    manager = ModelManager.get_instance()
     application.state.model_manager = manager
+    if settings.PRELOAD_MODELS:
+        # Load + warm up on the inference thread; startup (and the health
+        # check) doesn't wait, and the first request queues behind it.
+        logger.info("Preloading models in the background …")
+        manager.executor.submit(manager.load_all).add_done_callback(_log_preload_failure)
+    batcher = InferenceBatcher(
+        manager, settings.MAX_BATCH, settings.BATCH_TIMEOUT_MS, settings.INFERENCE_WORKERS
+    )
+    batcher.start()
+    application.state.batcher = batcher
+    application.state.frame_cache = FrameCache(
+        settings.FRAME_CACHE_TTL_MS, settings.FRAME_CACHE_MAX_DISTANCE
+    )
     logger.info("Server ready ✓")
     yield
     logger.info("Shutting down – releasing models …")
-    manager.unload_all()
+    await batcher.stop()
+    manager.shutdown()
 
 
 app = FastAPI(
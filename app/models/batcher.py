@@ -0,0 +1,115 @@
+"""
+InferenceBatcher – groups concurrent /api/analyze frames into one model pass.
+
+Each request queues its decoded frame and awaits a future. A single
+background task takes the first waiting frame, collects more for up to
+BATCH_TIMEOUT_MS (or until MAX_BATCH), and runs them through
+`ModelManager.infer_batch` on the inference executor. Up to
+INFERENCE_WORKERS batches run at once; while they are all busy, new
+requests pile up in the queue and form the next batch.
+"""
+
+import asyncio
+import logging
+
+from app.models.model_manager import InferenceResult, ModelManager
+
+logger = logging.getLogger("eyes.batcher")
+
+
+class InferenceBatcher:
+    """asyncio.Queue-backed micro-batcher in front of a ModelManager."""
+
+    def __init__(self, manager: ModelManager, max_batch: int, timeout_ms: float, max_in_flight: int = 1):
+        self.manager = manager
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout_ms / 1000.0
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+        # One slot per inference thread, so each batch has a worker ready
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self._batches: set[asyncio.Task] = set()
+
+    # ── lifecycle ──────────────────────────────────────────────
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="eyes-batcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._batches):
+            task.cancel()
+        await asyncio.gather(*self._batches, return_exceptions=True)
+
+    # ── public API ────────────────────────────────────────────
+
+    async def submit(self, image, enhance: bool) -> InferenceResult:
+        """Queue one decoded H×W×3 RGB frame and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image, enhance, future))
+        return await future
+
+    # ── internals ─────────────────────────────────────────────
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            self._start_batch(await self._collect())
+
+    def _start_batch(self, batch: list):
+        task = asyncio.create_task(self._run_batch(batch))
+        self._batches.add(task)
+        task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task):
+        self._batches.discard(task)
+        self._slots.release()
+
+    async def _run_batch(self, batch: list):
+        """Run one collected batch and resolve its futures.
+
+        A separate task so the batch's frames and results (depth maps may
+        be full-resolution device tensors) are released when it finishes,
+        not held while `_run` waits for the next request.
+        """
+        images, flags, futures = zip(*batch)
+        if len(futures) > 1:
+            logger.info(f"Running batch of {len(futures)} frames")
+        try:
+            results = await self.manager.run(
+                self.manager.infer_batch, list(images), list(flags)
+            )
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        # Futures of requests whose clients went away are already cancelled
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _collect(self) -> list:
+        """Block for one item, then gather more until full or timed out."""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.timeout
+        while len(batch) < self.max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
@@ -1,13 +1,15 @@
 """
 MiDaS monocular depth estimation wrapper.
 
-Uses the Intel/MiDaS_small model via PyTorch Hub for lightweight
+Uses the Intel/MiDaS_small model via PyTorch Hub (or an ONNX export run
+with ONNX Runtime when MIDAS_ONNX_PATH is set) for lightweight
 depth map prediction. The depth map is used alongside YOLO bounding
 boxes to estimate real-world distance to each detected object.
 
 Two estimation strategies:
-  1. **Depth-map median**: median inverse-depth value inside each bbox,
-     converted to approximate metres.
+  1. **Depth-map mean**: mean inverse-depth value inside each bbox
+     (O(1) per bbox via a summed-area table; exact median when
+     DEPTH_USE_MEDIAN is set), converted to approximate metres.
   2. **Pinhole fallback**: classic focal-length / bbox-height heuristic
      when the object has a known real-world height (from config).
 
@@ -15,171 +17,333 @@ The final distance for each detection is the average of both when
 available, otherwise whichever method succeeds.
 """
 
+from __future__ import annotations
+
 import logging
+import math
+import os
+from typing import TYPE_CHECKING
 
-import cv2
 import numpy as np
 import torch
-from PIL import Image
+import torch.nn.functional as F
 
 from app.config import settings
 
+if TYPE_CHECKING:
+    from app.models.yolo_detector import Detection
+
 logger = logging.getLogger("eyes.midas")
 
+# Network input sides are rounded to a multiple of this (as in the hub transforms)
+_NET_MULTIPLE = 32
+
+
+class _OrtDepthModel:
+    """ONNX Runtime session with the hub model's `model(x) -> [B, h, w]` call shape."""
+
+    def __init__(self, path: str, device: torch.device):
+        import onnxruntime as ort
+
+        available = ort.get_available_providers()
+        providers: list = []
+        if device.type == "cuda":
+            if "TensorrtExecutionProvider" in available:
+                providers.append((
+                    "TensorrtExecutionProvider",
+                    {
+                        "trt_fp16_enable": True,
+                        "trt_engine_cache_enable": True,
+                        "trt_engine_cache_path": os.path.dirname(path) or ".",
+                    },
+                ))
+            if "CUDAExecutionProvider" in available:
+                providers.append("CUDAExecutionProvider")
+        providers.append("CPUExecutionProvider")
+
+        self.session = ort.InferenceSession(path, providers=providers)
+        self.providers = self.session.get_providers()
+        self.on_gpu = self.providers[0] != "CPUExecutionProvider"
+        model_input = self.session.get_inputs()[0]
+        self._input = model_input.name
+        # (h, w) if the export has a static spatial size, else None
+        h, w = model_input.shape[-2:]
+        self.fixed_size = (h, w) if isinstance(h, int) and isinstance(w, int) else None
+        self._output = self.session.get_outputs()[0].name
+        self._device = device
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        # The exported graph takes FP32; TensorRT runs it in FP16 internally
+        x = x.float().contiguous()
+        if not self.on_gpu:
+            out = self.session.run([self._output], {self._input: x.cpu().numpy()})[0]
+            return torch.from_numpy(out).to(self._device)
+
+        # Bind device memory directly so the frame never leaves the GPU
+        out = torch.empty((x.shape[0], *x.shape[-2:]), dtype=torch.float32, device=x.device)
+        device_id = x.device.index or 0
+        binding = self.session.io_binding()
+        binding.bind_input(self._input, "cuda", device_id, np.float32, tuple(x.shape), x.data_ptr())
+        binding.bind_output(self._output, "cuda", device_id, np.float32, tuple(out.shape), out.data_ptr())
+        # ORT launches on its own stream and returns only when done, so the
+        # host blocks here: this backend can't overlap with YOLO
+        torch.cuda.current_stream().synchronize()
+        self.session.run_with_iobinding(binding)
+        binding.synchronize_outputs()
+        return out
+
+
+def _load_onnx(path: str, device: torch.device) -> _OrtDepthModel | None:
+    """Load an ONNX Runtime MiDaS session, or None to fall back to PyTorch Hub."""
+    if not os.path.isfile(path):
+        logger.warning(f"MiDaS ONNX model not found at {path}. Using PyTorch Hub model.")
+        return None
+    try:
+        model = _OrtDepthModel(path, device)
+    except Exception as e:
+        logger.warning(f"Failed to load MiDaS ONNX model: {e}. Using PyTorch Hub model.")
+        return None
+    logger.info(f"MiDaS ONNX model loaded from {path} ({model.providers[0]})")
+    return model
+
 
 class MidasDepth:
     def __init__(self):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-        # Load MiDaS small via torch hub
-        self.model = torch.hub.load(
-            "intel-isl/MiDaS",
-            settings.MIDAS_MODEL_TYPE,
-            trust_repo=True,
-        )
-        self.model.to(self.device).eval()
-
-        # Matching transforms
-        midas_transforms = torch.hub.load(
-            "intel-isl/MiDaS",
-            "transforms",
-            trust_repo=True,
-        )
+        # FP16 halves memory traffic and uses tensor cores on GPU;
+        # CPU kernels stay in FP32.
+        self.half = self.device.type == "cuda"
+        self.dtype = torch.float16 if self.half else torch.float32
+
+        self.model = None
+        if settings.MIDAS_ONNX_PATH:
+            self.model = _load_onnx(settings.MIDAS_ONNX_PATH, self.device)
+        # Whether estimate_depth_map_batch returns as soon as its kernels
+        # are queued (PyTorch), so other work can overlap with it
+        self.async_launch = self.model is None
+
+        if self.model is None:
+            # Load MiDaS small via torch hub
+            self.model = torch.hub.load(
+                "intel-isl/MiDaS",
+                settings.MIDAS_MODEL_TYPE,
+                trust_repo=True,
+            )
+            self.model.to(self.device).eval()
+            self.model.requires_grad_(False)
+            if self.half:
+                self.model = self.model.half()
+
+        # Preprocessing matching the hub transforms, done on-device instead
+        # of through the CPU/OpenCV pipeline: an aspect-preserving resize
+        # with both sides a multiple of 32, then normalisation. The small
+        # model fits the frame inside net_size ("upper_bound", 640×480 →
+        # 256×192); DPT scales the short side up to it ("minimal").
         if settings.MIDAS_MODEL_TYPE in ("DPT_Large", "DPT_Hybrid"):
-            self.transform = midas_transforms.dpt_transform
+            self.net_size = 384
+            self._upper_bound = False
+            mean, std = (0.5, 0.5, 0.5), (0.5, 0.5, 0.5)
         else:
-            self.transform = midas_transforms.small_transform
+            self.net_size = 256
+            self._upper_bound = True
+            mean, std = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+        # An ONNX export with a static input size dictates it instead
+        self._fixed_size = getattr(self.model, "fixed_size", None)
+
+        self.mean = torch.tensor(mean, device=self.device, dtype=self.dtype).view(1, 3, 1, 1)
+        self.std = torch.tensor(std, device=self.device, dtype=self.dtype).view(1, 3, 1, 1)
+
+        # Settings are fixed after startup; bind the per-frame ones once
+        self._focal = settings.FOCAL_LENGTH_PX
+        self._use_median = settings.DEPTH_USE_MEDIAN
 
         logger.info(f"MiDaS ({settings.MIDAS_MODEL_TYPE}) loaded on {self.device}")
 
     # ── public API ────────────────────────────────────────────
 
-    def estimate_depth_map(self, image: Image.Image) -> np.ndarray:
-        """Return a depth map (H×W float32, higher = closer)."""
-        img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        input_batch = self.transform(img_cv).to(self.device)
+    def estimate_depth_map_batch(self, frames: torch.Tensor) -> torch.Tensor:
+        """Return [B, H, W] depth maps (float32 on `self.device`, higher = closer).
 
-        with torch.no_grad():
-            prediction = self.model(input_batch)
-            prediction = torch.nn.functional.interpolate(
+        Takes a [B, 3, H, W] RGB tensor (0–1) already on `self.device`.
+        MiDaS expects RGB input, so no channel swap. The maps stay on
+        device; only per-bbox distances are copied back.
+        """
+        with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=self.half):
+            size = frames.shape[-2:]
+            x = F.interpolate(
+                frames.to(self.dtype),
+                size=self._fixed_size or self._net_input_size(*size),
+                mode="bilinear",
+                align_corners=False,
+            )
+            x.sub_(self.mean).div_(self.std)
+
+            prediction = self.model(x)
+            prediction = F.interpolate(
                 prediction.unsqueeze(1),
-                size=img_cv.shape[:2],
+                size=size,
                 mode="bicubic",
                 align_corners=False,
-            ).squeeze()
+            ).squeeze(1)
 
-        depth_map = prediction.cpu().numpy()
-        return depth_map
+        return prediction.float()
 
-    def estimate_distance(
+    def estimate_distances_batch(
         self,
-        depth_map: np.ndarray,
-        bbox: tuple[int, int, int, int],
-        label: str,
-        bbox_height_px: int,
+        depth_map: torch.Tensor | None,
+        detections: list[Detection],
         image_height: int,
-    ) -> float:
+        known_heights: np.ndarray,
+    ) -> list[float]:
         """
-        Estimate real-world distance (metres) to the object.
+        Estimate real-world distance (metres) to every detected object.
 
         Combines depth-map based estimation and pinhole-model
-        estimation when a known object height is available.
+        estimation when a known object height is available
+        (`known_heights` is indexed by class id, NaN when unknown). The
+        depth statistics for all bboxes are computed in one pass per frame.
+        With no depth map (MiDaS was skipped) only the pinhole estimate
+        is used.
         """
-        distances: list[float] = []
+        if not detections:
+            return []
+
+        heights = known_heights[[d.cls_id for d in detections]]
+        bbox_heights = np.array([d.bbox_height_px for d in detections], dtype=np.float64)
+        pinhole_dists = self._pinhole_distances(heights, bbox_heights, image_height)
+
+        if depth_map is None:
+            return np.nan_to_num(pinhole_dists, nan=0.0).tolist()
+
+        bboxes = np.array([d.bbox for d in detections], dtype=np.int64)
+        # Runs on a worker thread; torch kernels release the GIL
+        with torch.inference_mode():
+            depth_dists = self._depth_map_distances(depth_map, bboxes)
+
+        # Average whichever of the two estimates exist (NaN compares False)
+        depth_ok = depth_dists > 0
+        pinhole_ok = pinhole_dists > 0
+        total = np.where(depth_ok, depth_dists, 0.0) + np.where(pinhole_ok, pinhole_dists, 0.0)
+        count = depth_ok.astype(np.int64) + pinhole_ok
+        with np.errstate(invalid="ignore"):
+            results = np.round(total / count, 2)
+        return np.where(count > 0, results, 0.0).tolist()
 
-        # Strategy 1: Depth-map median inside bbox
-        depth_dist = self._depth_map_distance(depth_map, bbox)
-        if depth_dist is not None and depth_dist > 0:
-            distances.append(depth_dist)
+    # ── internals ─────────────────────────────────────────────
 
-        # Strategy 2: Pinhole model
-        pinhole_dist = self._pinhole_distance(label, bbox_height_px, image_height)
-        if pinhole_dist is not None and pinhole_dist > 0:
-            distances.append(pinhole_dist)
+    def _net_input_size(self, h: int, w: int) -> tuple[int, int]:
+        """Network input (h, w) for an h×w frame, as MiDaS's `Resize` transform computes it."""
+        if self._upper_bound:
+            scale = self.net_size / max(h, w)
+        else:
+            scale = self.net_size / min(h, w)
 
-        if not distances:
-            return 0.0
+        def _side(x: int) -> int:
+            steps = x * scale / _NET_MULTIPLE
+            y = round(steps) * _NET_MULTIPLE
+            if self._upper_bound and y > self.net_size:
+                y = math.floor(steps) * _NET_MULTIPLE
+            elif not self._upper_bound and y < self.net_size:
+                y = math.ceil(steps) * _NET_MULTIPLE
+            return max(_NET_MULTIPLE, y)
 
-        return round(float(np.mean(distances)), 2)
+        return _side(h), _side(w)
 
-    # ── internals ─────────────────────────────────────────────
+    def _depth_map_distances(self, depth_map: torch.Tensor, bboxes: np.ndarray) -> np.ndarray:
+        """Convert mean inverse-depth in each (N, 4) bbox region to metres.
 
-    @staticmethod
-    def _depth_map_distance(
-        depth_map: np.ndarray,
-        bbox: tuple[int, int, int, int],
-    ) -> float | None:
-        """Convert median inverse-depth in the bbox region to metres."""
-        x1, y1, x2, y2 = bbox
-        h, w = depth_map.shape[:2]
-
-        # Clamp bbox to depth map bounds
-        x1, y1 = max(0, x1), max(0, y1)
-        x2, y2 = min(w, x2), min(h, y2)
-        if x2 <= x1 or y2 <= y1:
-            return None
+        All reductions run on the depth map's device; the (N,) result is
+        the only device → host copy. Entries are NaN where no estimate
+        is possible.
+        """
+        h, w = depth_map.shape[-2:]
+        device = depth_map.device
+
+        # Clamp bboxes to depth map bounds
+        x1 = np.maximum(bboxes[:, 0], 0)
+        y1 = np.maximum(bboxes[:, 1], 0)
+        x2 = np.minimum(bboxes[:, 2], w)
+        y2 = np.minimum(bboxes[:, 3], h)
+        valid = (x2 > x1) & (y2 > y1)
 
         # Use center 60% of bbox for more accurate depth (avoids edges)
         cx = (x1 + x2) // 2
         cy = (y1 + y2) // 2
-        rw = max(1, int((x2 - x1) * 0.3))
-        rh = max(1, int((y2 - y1) * 0.3))
-        rx1 = max(0, cx - rw)
-        ry1 = max(0, cy - rh)
-        rx2 = min(w, cx + rw)
-        ry2 = min(h, cy + rh)
-
-        region = depth_map[ry1:ry2, rx1:rx2]
-        if region.size == 0:
-            region = depth_map[y1:y2, x1:x2]
-
-        median_val = float(np.median(region))
-
-        if median_val <= 0:
-            return None
+        rw = np.maximum(1, ((x2 - x1) * 0.3).astype(np.int64))
+        rh = np.maximum(1, ((y2 - y1) * 0.3).astype(np.int64))
+        rx1 = np.maximum(0, cx - rw)
+        ry1 = np.maximum(0, cy - rh)
+        rx2 = np.minimum(w, cx + rw)
+        ry2 = np.minimum(h, cy + rh)
+
+        # Fall back to the whole (clamped) bbox if the centre region is empty
+        empty = (rx2 <= rx1) | (ry2 <= ry1)
+        rx1, ry1 = np.where(empty, x1, rx1), np.where(empty, y1, ry1)
+        rx2, ry2 = np.where(empty, x2, rx2), np.where(empty, y2, ry2)
 
         # MiDaS outputs relative inverse depth.
         # Normalize against the full depth map range for more stable results.
-        depth_min = float(np.min(depth_map))
-        depth_max = float(np.max(depth_map))
+        depth_min, depth_max = torch.aminmax(depth_map)
         depth_range = depth_max - depth_min
-        if depth_range <= 0:
-            return None
+
+        if self._use_median:
+            # Debug path: per-region median (O(area) per bbox)
+            region_vals = torch.full((len(bboxes),), float("nan"), device=device)
+            for i in np.flatnonzero(valid):
+                region_vals[i] = depth_map[ry1[i]:ry2[i], rx1[i]:rx2[i]].flatten().quantile(0.5)
+        else:
+            # Summed-area table: each region mean becomes four lookups
+            integral = F.pad(depth_map.double().cumsum(0).cumsum(1), (1, 0, 1, 0))
+
+            def _idx(a: np.ndarray, upper: int) -> torch.Tensor:
+                return torch.from_numpy(np.clip(a, 0, upper)).to(device, non_blocking=True)
+
+            rx1_t, rx2_t = _idx(rx1, w), _idx(rx2, w)
+            ry1_t, ry2_t = _idx(ry1, h), _idx(ry2, h)
+            sums = (
+                integral[ry2_t, rx2_t] - integral[ry1_t, rx2_t]
+                - integral[ry2_t, rx1_t] + integral[ry1_t, rx1_t]
+            )
+            area = ((rx2_t - rx1_t) * (ry2_t - ry1_t)).clamp_(min=1)
+            valid_t = torch.from_numpy(valid).to(device, non_blocking=True)
+            region_vals = torch.where(valid_t, sums / area, float("nan")).float()
 
         # Normalized depth: 0 = farthest, 1 = closest
-        normalized = (median_val - depth_min) / depth_range
+        normalized = (region_vals - depth_min) / depth_range
 
         # Map normalized depth to distance (metres)
         # Close objects (normalized ~1.0) -> ~0.3m
         # Far objects (normalized ~0.0) -> ~15m
         MIN_DIST = 0.3
         MAX_DIST = 15.0
-        if normalized <= 0.01:
-            return MAX_DIST
-
         distance = MIN_DIST + (1.0 - normalized) * (MAX_DIST - MIN_DIST)
-        return round(min(max(distance, MIN_DIST), MAX_DIST), 2)
+        distance = torch.round(distance.clamp(MIN_DIST, MAX_DIST), decimals=2)
+        distance = torch.where(normalized <= 0.01, MAX_DIST, distance)
+
+        ok = (region_vals > 0) & (depth_range > 0)  # NaN compares False
+        return torch.where(ok, distance, float("nan")).cpu().numpy()
 
-    @staticmethod
-    def _pinhole_distance(
-        label: str,
-        bbox_height_px: int,
+    def _pinhole_distances(
+        self,
+        known_heights: np.ndarray,
+        bbox_heights: np.ndarray,
         image_height: int,
-    ) -> float | None:
-        """Classic D = (F × H_real) / H_pixel estimate.
+    ) -> np.ndarray:
+        """Classic D = (F × H_real) / H_pixel estimate for (N,) detections.
 
         Dynamically scales focal length based on image resolution
         so that distance estimates work regardless of camera resolution.
+        `known_heights` is NaN for classes without a known real-world
+        height; those entries (and empty bboxes) come back as NaN.
         """
-        known_h = settings.KNOWN_HEIGHTS.get(label)
-        if known_h is None or bbox_height_px <= 0:
-            return None
-
         # Scale focal length proportionally to image height.
         # The configured FOCAL_LENGTH_PX assumes a 640px image height.
         # Mobile cameras send varying resolutions, so we compensate.
         REFERENCE_HEIGHT = 640.0
-        scaled_focal = settings.FOCAL_LENGTH_PX * (image_height / REFERENCE_HEIGHT)
+        scaled_focal = self._focal * (image_height / REFERENCE_HEIGHT)
 
-        distance = (scaled_focal * known_h) / bbox_height_px
-        return round(min(max(distance, 0.2), 20.0), 2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance = scaled_focal * known_heights.astype(np.float64) / bbox_heights
+        distance = np.round(np.clip(distance, 0.2, 20.0), 2)
+        return np.where(bbox_heights > 0, distance, np.nan)
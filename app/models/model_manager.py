@@ -5,33 +5,105 @@ All imports are lazy to ensure the server starts instantly and
 passes Railway health checks before heavyweight libraries load.
 """
 
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
 
 logger = logging.getLogger("eyes.models")
 
+# Pinned host bytes a thread's CUDA staging buffers may span before they
+# stop reserving MAX_BATCH slots (device memory is 3× this: uint8 + fp16)
+_STAGING_BUDGET_BYTES = 64 * 1024 * 1024
+
+
+@dataclass
+class InferenceResult:
+    detections: list        # list[Detection]
+    depth_map: object       # torch.Tensor (H×W, on device) or None when MiDaS was skipped
+    enhanced: bool          # True if detections came from the enhanced frame
+
 
 class ModelManager:
-    """Singleton-like holder for all inference models with lazy loading."""
+    """Process-wide holder for all inference models with lazy loading.
+
+    Use `ModelManager.get_instance()` so every request in the process
+    shares one set of weights; models load on first use under a lock.
+    """
+
+    _instance: "ModelManager | None" = None
+    _instance_lock = threading.Lock()
 
     def __init__(self):
+        from app.config import settings
+
         self.yolo = None
         self.midas = None
         self.zero_dce = None
+        self._load_lock = threading.Lock()
+        # Per-thread CUDA staging buffers (`to_tensor`) and streams
+        # (`detect_and_depth`)
+        self._local = threading.local()
+        # Inference runs off the event loop; one worker by default so
+        # requests don't race on the (non thread-safe) model predictors.
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.INFERENCE_WORKERS,
+            thread_name_prefix="eyes-infer",
+        )
+
+    @classmethod
+    def get_instance(cls) -> "ModelManager":
+        """Return the process-wide manager, creating it on first call."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
 
     # ── lifecycle ──────────────────────────────────────────────
 
     def load_all(self):
-        logger.info("Loading YOLOv8 …")
-        from app.models.yolo_detector import YoloDetector
-        self.yolo = YoloDetector()
+        self.get_yolo()
+        self.get_midas()
+        self.get_zero_dce()
+        self.warmup()
 
-        logger.info("Loading MiDaS …")
-        from app.models.midas_depth import MidasDepth
-        self.midas = MidasDepth()
+    def warmup(self):
+        """Run dummy batches through every model.
 
-        logger.info("Loading Zero-DCE …")
-        from app.models.zero_dce_enhancer import ZeroDCEEnhancer
-        self.zero_dce = ZeroDCEEnhancer()
+        Pays CUDA context setup and cuDNN autotuning (benchmark mode) at
+        startup instead of on live /api/analyze requests. Benchmark mode
+        autotunes once per input shape, so every batch size up to
+        MAX_BATCH is run for square and 4:3 frames in both orientations;
+        the models' inputs depend only on the aspect ratio, not the
+        camera resolution. Frames of other aspect ratios still autotune
+        on first use.
+        """
+        import torch
+        from app.config import settings
+
+        device = self.get_midas().device
+        if device.type == "cuda":
+            torch.backends.cudnn.benchmark = True
+        dtype = torch.float16 if device.type == "cuda" else torch.float32
+
+        logger.info("Warming up models …")
+        long_side = settings.IMAGE_SIZE
+        short_side = long_side * 3 // 4
+        sizes = [(long_side, long_side), (short_side, long_side), (long_side, short_side)]
+        batch_sizes = range(1, max(1, settings.MAX_BATCH) + 1) if device.type == "cuda" else [1]
+        with torch.inference_mode():
+            for h, w in sizes:
+                for batch in batch_sizes:
+                    frames = torch.zeros(batch, 3, h, w, device=device, dtype=dtype)
+                    self.get_zero_dce().enhance_tensor(frames)
+                    self.get_yolo().detect_batch(frames)
+                    self.get_midas().estimate_depth_map_batch(frames)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        logger.info("Warm-up done.")
 
     def unload_all(self):
         self.yolo = None
@@ -39,28 +111,321 @@ class ModelManager:
         self.zero_dce = None
         logger.info("Models released.")
 
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.unload_all()
+        with ModelManager._instance_lock:
+            if ModelManager._instance is self:
+                ModelManager._instance = None
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking call on the inference executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    async def run_light(self, fn, *args, **kwargs):
+        """Run a short blocking call on the loop's default thread pool.
+
+        For per-request CPU work (decoding, bbox statistics) that shouldn't
+        block the event loop but also shouldn't queue behind inference.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(fn, *args, **kwargs))
+
+    async def decode_frame(self, data, content_type: str | None = None):
+        """Decode uploaded image bytes (or a file object) to `(image, brightness, frame_hash)`.
+
+        `image` is an H×W×3 RGB uint8 ndarray. The low-light check (mean
+        brightness, 0–1) and a 64-bit average hash for the frame cache
+        ride along on the same worker call. It runs on the loop's default
+        thread pool rather than the inference executor, so decoding the
+        next frame overlaps with inference on the current one.
+        `frame_hash` is None for tiny or featureless images.
+        """
+        return await self.run_light(_decode_frame, data, content_type)
+
     # ── lazy getters ───────────────────────────────────────────
 
     def get_yolo(self):
         """Get YOLO detector, loading if needed."""
         if self.yolo is None:
-            logger.info("Lazy loading YOLOv8 …")
-            from app.models.yolo_detector import YoloDetector
-            self.yolo = YoloDetector()
+            with self._load_lock:
+                if self.yolo is None:
+                    logger.info("Lazy loading YOLOv8 …")
+                    from app.models.yolo_detector import YoloDetector
+                    self.yolo = YoloDetector()
         return self.yolo
 
     def get_midas(self):
         """Get MiDaS depth estimator, loading if needed."""
         if self.midas is None:
-            logger.info("Lazy loading MiDaS …")
-            from app.models.midas_depth import MidasDepth
-            self.midas = MidasDepth()
+            with self._load_lock:
+                if self.midas is None:
+                    logger.info("Lazy loading MiDaS …")
+                    from app.models.midas_depth import MidasDepth
+                    self.midas = MidasDepth()
         return self.midas
 
     def get_zero_dce(self):
         """Get Zero-DCE enhancer, loading if needed."""
         if self.zero_dce is None:
-            logger.info("Lazy loading Zero-DCE …")
-            from app.models.zero_dce_enhancer import ZeroDCEEnhancer
-            self.zero_dce = ZeroDCEEnhancer()
+            with self._load_lock:
+                if self.zero_dce is None:
+                    logger.info("Lazy loading Zero-DCE …")
+                    from app.models.zero_dce_enhancer import ZeroDCEEnhancer
+                    self.zero_dce = ZeroDCEEnhancer()
         return self.zero_dce
+
+    # ── fused inference ────────────────────────────────────────
+
+    def to_tensor(self, images: list):
+        """Upload same-sized H×W×3 RGB uint8 frames once as a [B, 3, H, W] tensor (0–1).
+
+        FP16 on CUDA (matching the half-precision models), FP32 on CPU.
+        On CUDA each frame is written straight into its slot of a pinned
+        host buffer and the batch lands in a preallocated device buffer,
+        so the upload is a single async DMA and steady-state frames
+        allocate nothing. The returned tensor is a view of that buffer:
+        it is only valid until this thread's next call.
+        """
+        import numpy as np
+        import torch
+
+        device = self.get_midas().device
+        if device.type != "cuda":
+            stacked = images[0][None] if len(images) == 1 else np.stack(images)
+            frames = torch.from_numpy(stacked)
+            return frames.permute(0, 3, 1, 2).float().div_(255.0)
+
+        batch = len(images)
+        host, dev_u8, dev = self._staging_buffers(images[0].shape[:2], batch, device)
+        host_np = host.numpy()
+        for i, image in enumerate(images):
+            host_np[i] = image
+        dev_u8[:batch].copy_(host[:batch], non_blocking=True)
+        torch.div(dev_u8[:batch].permute(0, 3, 1, 2), 255.0, out=dev[:batch])
+        return dev[:batch]
+
+    def _staging_buffers(self, size: tuple[int, int], batch: int, device):
+        """Return this thread's (pinned host, device uint8, device fp16) buffers.
+
+        Only the most recent frame size is kept: a new size frees the old
+        buffers first. Room is reserved for MAX_BATCH frames so batches of
+        any size reuse the set, unless that would exceed
+        _STAGING_BUDGET_BYTES of pinned memory (e.g. 12 MP frames), in
+        which case only as many slots as the budget or this batch needs.
+        """
+        import torch
+        from app.config import settings
+
+        key = tuple(size)
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is not None and (buffers[0] != key or buffers[1][0].shape[0] < batch):
+            buffers = self._local.buffers = None  # release before allocating
+        if buffers is None:
+            h, w = key
+            budget_slots = _STAGING_BUDGET_BYTES // (h * w * 3)
+            slots = max(batch, min(settings.MAX_BATCH, budget_slots))
+            buffers = self._local.buffers = (key, (
+                torch.empty((slots, h, w, 3), dtype=torch.uint8, pin_memory=True),
+                torch.empty((slots, h, w, 3), dtype=torch.uint8, device=device),
+                torch.empty((slots, 3, h, w), dtype=torch.float16, device=device),
+            ))
+        return buffers[1]
+
+    def infer_batch(self, images: list, enhance: list[bool]) -> list[InferenceResult | Exception]:
+        """
+        Run Zero-DCE, then YOLO + MiDaS (`detect_and_depth`), on decoded frames.
+
+        Frames of the same size are stacked and go through each model as
+        one batch; differently sized frames form separate batches. Results
+        come back in input order. A batch that fails yields its exception
+        in place of each of its frames' results, so one bad frame doesn't
+        fail the other sizes. Uploading happens here, on the calling
+        thread, so the staging buffer can't be reused by another request
+        mid-inference.
+        """
+        groups: dict[tuple, list[int]] = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+
+        results: list[InferenceResult | Exception | None] = [None] * len(images)
+        for idx in groups.values():
+            try:
+                frames = self.to_tensor([images[i] for i in idx])
+                batch = self._infer_frames(frames, [enhance[i] for i in idx])
+            except Exception as e:
+                logger.exception(f"Inference failed for a batch of {len(idx)} frame(s)")
+                batch = [e] * len(idx)
+            for i, result in zip(idx, batch):
+                results[i] = result
+        return results
+
+    def _infer_frames(self, frames, enhance: list[bool]) -> list[InferenceResult]:
+        """Fused pass over a [B, 3, H, W] device batch.
+
+        All three models share the same input tensor, so the frames cross
+        the host/device boundary once and no PIL/NumPy round-trips happen
+        between stages. Frames flagged in `enhance` go through Zero-DCE
+        first; if an enhanced frame yields no detections, YOLO is retried
+        on the original frame (already on device).
+        """
+        import torch
+
+        with torch.inference_mode():
+            source = frames
+            enhanced_idx = [i for i, flag in enumerate(enhance) if flag]
+            if enhanced_idx:
+                zero_dce = self.get_zero_dce()
+                if len(enhanced_idx) == len(enhance):
+                    source = zero_dce.enhance_tensor(frames)
+                else:
+                    source = frames.clone()
+                    source[enhanced_idx] = zero_dce.enhance_tensor(frames[enhanced_idx])
+
+            detections, depth_maps = self.detect_and_depth(source)
+            enhanced = list(enhance)
+
+            retry_idx = [i for i in enhanced_idx if not detections[i]]
+            if retry_idx:
+                logger.info("Enhancement may have degraded image → retrying with original")
+                # Depth is rarely needed here, so it waits for the detections
+                retry_dets, retry_depths = self.detect_and_depth(frames[retry_idx], speculative_depth=False)
+                for i, dets, depth_map in zip(retry_idx, retry_dets, retry_depths):
+                    if dets:
+                        detections[i], depth_maps[i], enhanced[i] = dets, depth_map, False
+
+        return [
+            InferenceResult(detections=dets, depth_map=depth_map, enhanced=flag)
+            for dets, depth_map, flag in zip(detections, depth_maps, enhanced)
+        ]
+
+    def detect_and_depth(self, source, speculative_depth: bool = True):
+        """Run YOLO and (when needed) MiDaS on a [B, 3, H, W] device batch.
+
+        Returns per-frame detection lists and depth maps (None where no
+        depth was computed). By default YOLO runs first and MiDaS only on
+        the frames whose detections need it. With DEPTH_OVERLAP_STREAMS
+        on CUDA (and `speculative_depth`), MiDaS is instead launched up
+        front on its own stream so its kernels overlap with YOLO's on a
+        second stream; wall-clock is ≈ max of the two rather than the
+        sum, but every frame pays for a MiDaS pass. Since that work is
+        already done, the maps are kept for every frame with detections.
+        The ONNX Runtime backend blocks until MiDaS finishes, so it
+        always takes the default order.
+        """
+        import torch
+        from app.config import settings
+
+        yolo = self.get_yolo()
+        midas = self.get_midas()
+
+        overlap = (
+            source.is_cuda
+            and speculative_depth
+            and settings.DEPTH_OVERLAP_STREAMS
+            and midas.async_launch  # ONNX Runtime blocks until MiDaS is done
+        )
+        if not overlap:
+            detections = yolo.detect_batch(source)
+            depth_maps = [None] * len(detections)
+            need = [i for i, dets in enumerate(detections) if self._needs_depth(dets)]
+            if need:
+                batch = source if len(need) == len(detections) else source[need]
+                for i, depth_map in zip(need, midas.estimate_depth_map_batch(batch)):
+                    depth_maps[i] = depth_map
+            return detections, depth_maps
+
+        yolo_stream, midas_stream = self._cuda_streams()
+        current = torch.cuda.current_stream()
+        yolo_stream.wait_stream(current)
+        midas_stream.wait_stream(current)
+        source.record_stream(midas_stream)
+
+        # Kernel launches are async, so this returns before MiDaS finishes
+        with torch.cuda.stream(midas_stream):
+            depth_batch = midas.estimate_depth_map_batch(source)
+        # Ultralytics copies boxes to host, which blocks on YOLO's stream only
+        with torch.cuda.stream(yolo_stream):
+            detections = yolo.detect_batch(source)
+
+        midas_stream.synchronize()
+        depth_maps = [
+            depth_map if dets else None
+            for dets, depth_map in zip(detections, depth_batch)
+        ]
+        return detections, depth_maps
+
+    def _cuda_streams(self):
+        """Return this thread's (YOLO, MiDaS) CUDA streams, created once."""
+        import torch
+
+        streams = getattr(self._local, "streams", None)
+        if streams is None:
+            streams = (torch.cuda.Stream(), torch.cuda.Stream())
+            self._local.streams = streams
+        return streams
+
+    def _needs_depth(self, detections) -> bool:
+        """Whether any detection needs a MiDaS depth estimate.
+
+        Only DEPTH_RELEVANT_LABELS count (currency, tabletop items etc.
+        never do), and by default only those without a known height,
+        since pinhole covers the rest.
+        """
+        import numpy as np
+        from app.config import settings
+
+        if not detections:
+            return False
+        yolo = self.get_yolo()
+        cls_ids = [d.cls_id for d in detections]
+        relevant = yolo.depth_relevant[cls_ids]
+        if settings.DEPTH_SKIP_KNOWN_HEIGHTS:
+            relevant &= np.isnan(yolo.known_heights[cls_ids])
+        return bool(relevant.any())
+
+
+# ── decoding ───────────────────────────────────────────────────
+
+_JPEG_MAGIC = b"\xff\xd8"
+_JPEG_CONTENT_TYPES = frozenset({"image/jpeg", "image/jpg", "image/pjpeg"})
+
+
+def _decode_rgb(data, content_type: str | None = None):
+    """JPEG via libjpeg-turbo (simplejpeg); anything else via Pillow.
+
+    The declared content type only rules simplejpeg out (e.g. image/png);
+    clients often send octet-stream, so JPEGs are recognised by their
+    SOI marker. JPEGs simplejpeg rejects (e.g. CMYK) go to Pillow.
+    """
+    import numpy as np
+
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        data = data.read()  # e.g. UploadFile.file, read on this worker thread
+
+    declared_other = (
+        content_type is not None
+        and content_type.startswith("image/")
+        and content_type not in _JPEG_CONTENT_TYPES
+    )
+    if not declared_other and data[:2] == _JPEG_MAGIC:
+        import simplejpeg
+        try:
+            return simplejpeg.decode_jpeg(data, colorspace="RGB")
+        except ValueError as e:
+            logger.warning(f"libjpeg-turbo decode failed ({e}); falling back to Pillow")
+
+    import io
+    from PIL import Image
+    # np.array, not asarray: torch.from_numpy needs a writable buffer
+    with Image.open(io.BytesIO(data)) as image:
+        return np.array(image.convert("RGB"))
+
+
+def _decode_frame(data, content_type: str | None = None):
+    from app.services.frame_cache import average_hash, luma_thumbnail
+
+    image = _decode_rgb(data, content_type)
+    luma = luma_thumbnail(image)
+    return image, float(luma.mean() / 255.0), average_hash(luma)
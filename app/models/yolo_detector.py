@@ -11,58 +11,141 @@ import logging
 from dataclasses import dataclass
 
 import numpy as np
-from PIL import Image
+import torch
+import torch.nn.functional as F
 from ultralytics import YOLO
 
-from app.config import settings
+from app.config import (
+    CRITICAL_OBJECTS,
+    DEPTH_RELEVANT_LABELS,
+    HAZARD_OBJECTS,
+    KNOWN_HEIGHTS,
+    TIER_CRITICAL,
+    TIER_HAZARD,
+    settings,
+)
 
 logger = logging.getLogger("eyes.yolo")
 
+# YOLO tensor inputs must be BCHW with H and W divisible by the model stride.
+_STRIDE = 32
+_PAD_VALUE = 114 / 255.0  # same grey Ultralytics uses for letterboxing
+
 
 @dataclass
 class Detection:
     label: str
-    confidence: float
+    confidence: float  # rounded to 3 decimals
     bbox: tuple[int, int, int, int]  # x1, y1, x2, y2
     bbox_height_px: int
+    cls_id: int
 
 
 class YoloDetector:
     def __init__(self):
+        # Accepts `.pt` weights or an exported TensorRT `.engine` (`yolo
+        # export model=yolov8n.pt format=engine half=True dynamic=True
+        # batch=MAX_BATCH`). Exported models take square IMAGE_SIZE inputs.
         self.model = YOLO(settings.YOLO_MODEL_PATH)
-        logger.info(f"YOLO loaded from {settings.YOLO_MODEL_PATH}")
+        self._square = not settings.YOLO_MODEL_PATH.endswith(".pt")
+        # Ultralytics ignores `half` on CPU, so this only kicks in on GPU
+        self.half = torch.cuda.is_available()
+        # Class-id → label lookup table, resolved once instead of per box
+        self.names = np.array(
+            [self.model.names[i] for i in range(len(self.model.names))], dtype=object
+        )
+
+        # Per-class lookups indexed by class id (NaN = no known height)
+        self.known_heights = np.full(len(self.names), np.nan, dtype=np.float32)
+        # Safety tiers packed as bit flags, so one gather per frame yields both
+        self.tiers = np.zeros(len(self.names), dtype=np.uint8)
+        # Classes worth a MiDaS pass (see DEPTH_RELEVANT_LABELS)
+        self.depth_relevant = np.isin(self.names, list(DEPTH_RELEVANT_LABELS))
+        for i, name in enumerate(self.names):
+            if name in KNOWN_HEIGHTS:
+                self.known_heights[i] = KNOWN_HEIGHTS[name]
+            if name in CRITICAL_OBJECTS:
+                self.tiers[i] |= TIER_CRITICAL
+            if name in HAZARD_OBJECTS:
+                self.tiers[i] |= TIER_HAZARD
+
+        # Settings are fixed after startup; bind the per-frame ones once
+        self._imgsz = settings.IMAGE_SIZE
+        self._conf = settings.CONFIDENCE_THRESHOLD
+
+        logger.info(f"YOLO loaded from {settings.YOLO_MODEL_PATH} (fp16={self.half})")
+
+    def detect_batch(self, frames: torch.Tensor, conf: float | None = None) -> list[list[Detection]]:
+        """Run inference on a [B, 3, H, W] RGB tensor (0–1) already on device.
 
-    def detect(self, image: Image.Image, conf: float | None = None) -> list[Detection]:
-        """Run inference on a PIL Image and return a list of Detections."""
-        threshold = conf or settings.CONFIDENCE_THRESHOLD
-        img_w, img_h = image.size
-        logger.info(f"YOLO input: {img_w}x{img_h}, conf={threshold}, imgsz={settings.IMAGE_SIZE}")
+        The frames are resized on-device so their long side matches
+        IMAGE_SIZE and padded bottom/right to a stride multiple (to the
+        full IMAGE_SIZE square for exported models); boxes are
+        mapped back to the original frame coordinates. Returns one
+        detection list per frame.
+        """
+        threshold = conf or self._conf
+        batch, _, img_h, img_w = frames.shape
+        logger.info(f"YOLO input: {batch}×{img_w}x{img_h}, conf={threshold}, imgsz={self._imgsz}")
+
+        scale = self._imgsz / max(img_h, img_w)
+        new_h, new_w = round(img_h * scale), round(img_w * scale)
+        x = F.interpolate(frames, size=(new_h, new_w), mode="bilinear", align_corners=False)
+        if self._square:
+            pad_h, pad_w = self._imgsz - new_h, self._imgsz - new_w
+        else:
+            pad_h, pad_w = -new_h % _STRIDE, -new_w % _STRIDE
+        if pad_h or pad_w:
+            x = F.pad(x, (0, pad_w, 0, pad_h), value=_PAD_VALUE)
 
         results = self.model.predict(
-            source=image,
-            imgsz=settings.IMAGE_SIZE,
+            source=x,
+            imgsz=self._imgsz,
             conf=threshold,
+            half=self.half,
             verbose=False,
         )
+        return [
+            self._to_detections([result], threshold, scale, (img_w, img_h))
+            for result in results
+        ]
+
+    # ── internals ─────────────────────────────────────────────
+
+    def _to_detections(
+        self,
+        results,
+        threshold: float,
+        scale: float,
+        clip: tuple[int, int],
+    ) -> list[Detection]:
         detections: list[Detection] = []
         for result in results:
             boxes = result.boxes
-            if boxes is None:
+            if boxes is None or len(boxes) == 0:
                 continue
-            for box in boxes:
-                cls_id = int(box.cls[0])
-                label = self.model.names[cls_id]
-                confidence = float(box.conf[0])
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
-                bbox_h = int(y2 - y1)
-                detections.append(
-                    Detection(
-                        label=label,
-                        confidence=confidence,
-                        bbox=(int(x1), int(y1), int(x2), int(y2)),
-                        bbox_height_px=bbox_h,
-                    )
+            # One device → host copy per frame: rows are x1, y1, x2, y2, conf, cls
+            data = boxes.data.cpu().numpy()
+            xyxy = np.clip(data[:, :4] / scale, 0, [clip[0], clip[1], clip[0], clip[1]])
+            cls_ids = data[:, 5].astype(np.int32)
+            labels = self.names[cls_ids]
+            detections.extend(
+                Detection(
+                    label=label,
+                    confidence=confidence,
+                    bbox=(x1, y1, x2, y2),
+                    bbox_height_px=y2 - y1,
+                    cls_id=cls_id,
+                )
+                for label, confidence, (x1, y1, x2, y2), cls_id in zip(
+                    labels.tolist(),
+                    # Rounded here, in one vectorised call, to the 3 decimals
+                    # the API reports (float64 first so 0.905 stays 0.905)
+                    np.round(data[:, 4].astype(np.float64), 3).tolist(),
+                    xyxy.astype(np.int32).tolist(),
+                    cls_ids.tolist(),
                 )
+            )
 
         if detections:
             logger.info(f"Detected {len(detections)} objects: {[(d.label, f'{d.confidence:.2f}') for d in detections]}")
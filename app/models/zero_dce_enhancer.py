@@ -7,61 +7,95 @@ Mirrors the architecture from the training notebook:
     producing 24 parameter maps (8 iterations × 3 channels).
   - Enhancement: iterative curve application LE(x) = x + α·x·(1−x).
 
-On startup the model attempts to load a Keras H5 model from
-`models/zero_dce_model.h5`. If not found, it falls back to
-a simple histogram-equalization placeholder so the pipeline
-doesn't break while you upload the real weights.
+On startup the model reads the Keras H5 weights from
+`models/zero_dce_model.h5` with h5py and copies them into an equivalent
+PyTorch DCE-Net, so inference runs on the same device as YOLO/MiDaS
+without loading TensorFlow. If not found, it falls back to a simple
+histogram-equalization placeholder so the pipeline doesn't break while
+you upload the real weights.
 """
 
 import logging
 import os
 
-import numpy as np
-from PIL import Image, ImageOps
+import h5py
+import torch
+import torch.nn.functional as F
+from torch import nn
 
 logger = logging.getLogger("eyes.zero_dce")
 
-# We only import TensorFlow if the model file exists to keep startup
-# lightweight when the model hasn't been deployed yet.
-_tf = None
+# Fallback contrast cutoffs are taken on a ~64×64 strided grid per channel
+_FALLBACK_SAMPLES = 64
 
 
-def _lazy_import_tf():
-    global _tf
-    if _tf is None:
-        os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-        import tensorflow as tf
-        tf.get_logger().setLevel("ERROR")
-        _tf = tf
-    return _tf
+class DCENet(nn.Module):
+    """PyTorch port of DCE-Net (NCHW, same layer order as the Keras model)."""
 
+    def __init__(self):
+        super().__init__()
+        self.conv1 = nn.Conv2d(3, 32, 3, padding=1)
+        self.conv2 = nn.Conv2d(32, 32, 3, padding=1)
+        self.conv3 = nn.Conv2d(32, 32, 3, padding=1)
+        self.conv4 = nn.Conv2d(32, 32, 3, padding=1)
+        self.conv5 = nn.Conv2d(64, 32, 3, padding=1)
+        self.conv6 = nn.Conv2d(64, 32, 3, padding=1)
+        self.conv7 = nn.Conv2d(64, 24, 3, padding=1)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        c1 = F.relu(self.conv1(x))
+        c2 = F.relu(self.conv2(c1))
+        c3 = F.relu(self.conv3(c2))
+        c4 = F.relu(self.conv4(c3))
+        c5 = F.relu(self.conv5(torch.cat([c4, c3], dim=1)))
+        c6 = F.relu(self.conv6(torch.cat([c5, c2], dim=1)))
+        return torch.tanh(self.conv7(torch.cat([c6, c1], dim=1)))
+
+    def load_h5_weights(self, path: str) -> None:
+        """Copy Conv2D kernels/biases from a Keras H5 file (HWIO → OIHW).
+
+        Works for both full-model saves (`model.save`) and weights-only
+        saves (`model.save_weights`); layers are matched in model order.
+        """
+        with h5py.File(path, "r") as f:
+            root = f["model_weights"] if "model_weights" in f else f
+            kernels = []
+            for layer_name in root.attrs["layer_names"]:
+                layer = root[_decode(layer_name)]
+                weight_names = [_decode(n) for n in layer.attrs["weight_names"]]
+                if weight_names:  # skip Input / Concatenate layers
+                    kernel = next(n for n in weight_names if n.endswith("kernel"))
+                    bias = next(n for n in weight_names if n.endswith("bias"))
+                    kernels.append((layer[kernel][()], layer[bias][()]))
+
+        torch_convs = [m for m in self.modules() if isinstance(m, nn.Conv2d)]
+        if len(kernels) != len(torch_convs):
+            raise ValueError(
+                f"Expected {len(torch_convs)} Conv2D layers, found {len(kernels)}"
+            )
+        with torch.no_grad():
+            for (kernel, bias), dst in zip(kernels, torch_convs):
+                dst.weight.copy_(torch.from_numpy(kernel).permute(3, 2, 0, 1))
+                dst.bias.copy_(torch.from_numpy(bias))
 
-def _build_dce_net(image_size=256):
-    """Rebuild the DCE-Net architecture so we can load .h5 weights."""
-    tf = _lazy_import_tf()
-    keras = tf.keras
-    layers = keras.layers
 
-    input_image = keras.Input(shape=[image_size, image_size, 3])
-    conv1 = layers.Conv2D(32, (3, 3), strides=(1, 1), activation="relu", padding="same")(input_image)
-    conv2 = layers.Conv2D(32, (3, 3), strides=(1, 1), activation="relu", padding="same")(conv1)
-    conv3 = layers.Conv2D(32, (3, 3), strides=(1, 1), activation="relu", padding="same")(conv2)
-    conv4 = layers.Conv2D(32, (3, 3), strides=(1, 1), activation="relu", padding="same")(conv3)
-    int_con1 = layers.Concatenate(axis=-1)([conv4, conv3])
-    conv5 = layers.Conv2D(32, (3, 3), strides=(1, 1), activation="relu", padding="same")(int_con1)
-    int_con2 = layers.Concatenate(axis=-1)([conv5, conv2])
-    conv6 = layers.Conv2D(32, (3, 3), strides=(1, 1), activation="relu", padding="same")(int_con2)
-    int_con3 = layers.Concatenate(axis=-1)([conv6, conv1])
-    x_r = layers.Conv2D(24, (3, 3), strides=(1, 1), activation="tanh", padding="same")(int_con3)
+def _decode(name) -> str:
+    """h5py returns attribute strings as bytes or str depending on the writer."""
+    return name.decode("utf-8") if isinstance(name, bytes) else name
 
-    return keras.Model(inputs=input_image, outputs=x_r)
 
+@torch.jit.script
+def _apply_enhancement(image_tensor: torch.Tensor, curve_params: torch.Tensor) -> torch.Tensor:
+    """Apply iterative curve enhancement: LE(x) = x + α·x·(1−x), 8 iterations.
 
-def _apply_enhancement(image_tensor, curve_params):
-    """Apply iterative curve enhancement: LE(x) = x + α·x·(1−x), 8 iterations."""
+    Scripted so the fuser can collapse the multiply-add chain into a
+    single elementwise kernel instead of materialising 8 temporaries.
+    """
+    b, _, h, w = curve_params.size()
+    curves = curve_params.reshape(b, 8, 3, h, w)
     x = image_tensor
-    for i in range(0, 3 * 8, 3):
-        r = curve_params[:, :, :, i:i + 3]
+    for i in range(8):
+        r = curves[:, i]
         x = x + r * (x - x * x)
     return x
 
@@ -69,24 +103,20 @@ def _apply_enhancement(image_tensor, curve_params):
 class ZeroDCEEnhancer:
     """Enhance low-light images using Zero-DCE (or fallback)."""
 
-    def __init__(self):
+    def __init__(self, image_size: int = 256):
         from app.config import settings
 
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.image_size = image_size  # DCE-Net working resolution (square)
         self.dce_model = None
         model_path = settings.ZERO_DCE_MODEL_PATH
 
         if os.path.isfile(model_path):
             try:
-                tf = _lazy_import_tf()
-                # Try loading as a full Keras model first
-                try:
-                    self.dce_model = tf.keras.models.load_model(model_path, compile=False)
-                    logger.info(f"Zero-DCE Keras model loaded from {model_path}")
-                except Exception:
-                    # If that fails, rebuild architecture and load weights only
-                    self.dce_model = _build_dce_net()
-                    self.dce_model.load_weights(model_path)
-                    logger.info(f"Zero-DCE weights loaded into rebuilt DCE-Net from {model_path}")
+                net = DCENet()
+                net.load_h5_weights(model_path)
+                self.dce_model = net.to(self.device).eval().requires_grad_(False)
+                logger.info(f"Zero-DCE weights loaded from {model_path} on {self.device}")
             except Exception as e:
                 logger.warning(f"Failed to load Zero-DCE model: {e}. Using fallback.")
         else:
@@ -97,51 +127,43 @@ class ZeroDCEEnhancer:
 
     # ── public API ────────────────────────────────────────────
 
-    def enhance(self, image: Image.Image) -> Image.Image:
-        """Return an enhanced PIL Image."""
-        if self.dce_model is not None:
-            return self._enhance_with_model(image)
-        return self._fallback_enhance(image)
-
-    @staticmethod
-    def is_low_light(image: Image.Image, threshold: float = 0.15) -> bool:
-        """Heuristic: if average pixel brightness < threshold consider low-light."""
-        gray = image.convert("L")
-        mean_brightness = np.array(gray).mean() / 255.0
-        return mean_brightness < threshold
-
-    @staticmethod
-    def get_brightness(image: Image.Image) -> float:
-        """Return average brightness of the image as 0.0–1.0."""
-        gray = image.convert("L")
-        return float(np.array(gray).mean() / 255.0)
-
-    # ── internals ─────────────────────────────────────────────
+    def enhance_tensor(self, frame: torch.Tensor) -> torch.Tensor:
+        """Enhance a [B, 3, H, W] RGB tensor (0–1) already on `self.device`.
 
-    def _enhance_with_model(self, image: Image.Image) -> Image.Image:
-        tf = _lazy_import_tf()
-        original_size = image.size
+        Resizing to/from the DCE-Net resolution happens on device (and is
+        skipped when the sizes already match).
+        """
+        if self.dce_model is None:
+            return self._fallback_enhance_tensor(frame)
 
-        img_array = np.array(image.resize((256, 256))).astype("float32") / 255.0
-        img_array = img_array[:, :, :3]  # drop alpha if present
-        input_tensor = tf.expand_dims(img_array, axis=0)
+        size = tuple(frame.shape[-2:])
+        target = (self.image_size, self.image_size)
+        resize = size != target
 
-        # Get curve parameter maps from DCE-Net
-        curve_params = self.dce_model(input_tensor)
+        with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=frame.is_cuda):
+            x = frame
+            if resize:
+                x = F.interpolate(x, size=target, mode="bilinear", align_corners=False)
+            enhanced = _apply_enhancement(x, self.dce_model(x))
+            if resize:
+                enhanced = F.interpolate(enhanced, size=size, mode="bilinear", align_corners=False)
+            return enhanced.clamp_(0.0, 1.0)
 
-        # Apply iterative curve enhancement
-        enhanced = _apply_enhancement(input_tensor, curve_params)
-
-        output_np = enhanced[0].numpy()
-        output_np = np.clip(output_np * 255.0, 0, 255).astype(np.uint8)
-
-        # Resize back to original dimensions
-        result = Image.fromarray(output_np)
-        result = result.resize(original_size, Image.LANCZOS)
-        return result
+    # ── internals ─────────────────────────────────────────────
 
     @staticmethod
-    def _fallback_enhance(image: Image.Image) -> Image.Image:
-        """Simple auto-contrast + brightness boost as a stand-in."""
-        enhanced = ImageOps.autocontrast(image, cutoff=1)
-        return enhanced
+    def _fallback_enhance_tensor(frame: torch.Tensor) -> torch.Tensor:
+        """Simple per-channel 1% auto-contrast as a stand-in.
+
+        The cutoffs come from a strided subsample: torch.quantile rejects
+        inputs over 2**24 elements, which a 12 MP frame or a batch of
+        1080p frames exceeds.
+        """
+        h, w = frame.shape[-2:]
+        step_y = max(1, h // _FALLBACK_SAMPLES)
+        step_x = max(1, w // _FALLBACK_SAMPLES)
+        flat = frame[..., ::step_y, ::step_x].flatten(2).float()
+        lo = torch.quantile(flat, 0.01, dim=-1)[..., None, None]
+        hi = torch.quantile(flat, 0.99, dim=-1)[..., None, None]
+        scale = (hi - lo).clamp_(min=1e-6)
+        return ((frame - lo) / scale).clamp_(0.0, 1.0).to(frame.dtype)
@@ -7,6 +7,9 @@ into a human-readable string and computes the total.
 """
 
 from __future__ import annotations
+
+from collections import Counter
+from functools import lru_cache
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -27,6 +30,17 @@ _CURRENCY_MAP: dict[str, tuple[str, float]] = {
     "coin_10": ("₱10 coin", 10),
 }
 
+# Split views of the map, so the per-request path does plain lookups
+_CURRENCY_DISPLAY: dict[str, str] = {label: name for label, (name, _) in _CURRENCY_MAP.items()}
+_CURRENCY_VALUE: dict[str, float] = {label: value for label, (_, value) in _CURRENCY_MAP.items()}
+
+
+@lru_cache(maxsize=256)
+def _format_part(label: str, count: int) -> str:
+    """One summary entry, e.g. "2× ₱100 bill"; only a few dozen distinct strings occur."""
+    display_name = _CURRENCY_DISPLAY[label]
+    return f"{count}× {display_name}" if count > 1 else display_name
+
 
 def detect_currency(detections: list[Detection]) -> str | None:
     """
@@ -36,26 +50,15 @@ def detect_currency(detections: list[Detection]) -> str | None:
     Example: "2× ₱100 bill, 1× ₱20 bill – total ₱220"
     Returns None if no currency is detected.
     """
-    from collections import Counter
-
-    counts: Counter[str] = Counter()
-
-    for det in detections:
-        if det.label in _CURRENCY_MAP:
-            counts[det.label] += 1
-
+    counts = Counter(det.label for det in detections if det.label in _CURRENCY_VALUE)
     if not counts:
         return None
 
+    # One pass over the denominations for both the total and the parts
     total = 0.0
     parts: list[str] = []
     for label, count in counts.items():
-        display_name, value = _CURRENCY_MAP[label]
-        total += value * count
-        if count > 1:
-            parts.append(f"{count}× {display_name}")
-        else:
-            parts.append(display_name)
-
-    names = ", ".join(parts)
-    return f"{names} – total ₱{total:,.0f}"
+        total += _CURRENCY_VALUE[label] * count
+        parts.append(_format_part(label, count))
+
+    return f"{', '.join(parts)} – total ₱{total:,.0f}"
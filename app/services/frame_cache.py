@@ -0,0 +1,104 @@
+"""
+Frame cache – reuses the last response for near-identical consecutive frames.
+
+Mobile clients stream frames several times a second while the scene
+barely changes. Each frame gets a 64-bit average hash (computed from the
+luma thumbnail already used for the low-light check); if a client's new
+frame is within FRAME_CACHE_MAX_DISTANCE bits of its previous one and
+that result is younger than FRAME_CACHE_TTL_MS, the cached response is
+returned without running the models.
+
+The luma thumbnail itself lives here too, so the decode worker can
+measure brightness and hash a frame with numpy alone, without importing
+torch or the Zero-DCE model.
+
+Clients are identified only by the X-Client-Id header; requests without
+one bypass the cache. Featureless frames (black, covered lens, blank
+wall) all hash alike, so they get no hash and are never cached.
+"""
+
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# ITU-R 601 luma weights (what PIL uses for RGB → "L")
+_LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+_BRIGHTNESS_SAMPLES = 64  # brightness is measured on a ~64×64 nearest-neighbour grid
+_HASH_SIZE = 8  # 8×8 blocks → 64-bit hash
+_MAX_CLIENTS = 256
+_MIN_CONTRAST = 1.0  # block-mean spread (luma levels) below which a frame is featureless
+
+
+def luma_thumbnail(image: np.ndarray) -> np.ndarray:
+    """Return a ~64×64 luma (0–255) thumbnail of an RGB ndarray.
+
+    Uses the same luma weights as PIL's "L" mode on a nearest-neighbour
+    grid (a strided view, no resize or copy) – plenty for a threshold
+    decision or a frame hash, and a constant cost whatever the camera
+    resolution.
+    """
+    image = np.asarray(image)
+    step_y = max(1, image.shape[0] // _BRIGHTNESS_SAMPLES)
+    step_x = max(1, image.shape[1] // _BRIGHTNESS_SAMPLES)
+    sample = image[::step_y, ::step_x, :3]
+    return np.einsum("hwc,c->hw", sample, _LUMA_WEIGHTS)
+
+
+def average_hash(luma: np.ndarray) -> int | None:
+    """64-bit average hash of a 2-D luma thumbnail.
+
+    Each bit says whether one of 8×8 blocks is brighter than the mean, so
+    the hash survives sensor noise and small exposure changes. Returns
+    None if the thumbnail is smaller than 8×8 or its blocks are all
+    (nearly) equal, since such a hash says nothing about the scene.
+    """
+    h, w = luma.shape
+    bh, bw = h // _HASH_SIZE, w // _HASH_SIZE
+    if bh == 0 or bw == 0:
+        return None
+    blocks = luma[:bh * _HASH_SIZE, :bw * _HASH_SIZE].reshape(_HASH_SIZE, bh, _HASH_SIZE, bw).mean(axis=(1, 3))
+    if np.ptp(blocks) < _MIN_CONTRAST:
+        return None
+    bits = np.packbits(blocks > blocks.mean())
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+class FrameCache:
+    """Last response per client, keyed by a client id.
+
+    Only touched from the event loop, so no locking is needed. Entries
+    are not refreshed on a hit: a static scene is still re-analysed once
+    per TTL.
+    """
+
+    def __init__(self, ttl_ms: float, max_distance: int):
+        self.ttl = ttl_ms / 1000.0
+        self.max_distance = max_distance
+        self._entries: OrderedDict[str, tuple[int, float, dict]] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, client_id: str | None, frame_hash: int | None) -> dict | None:
+        """Return the client's cached response if this frame matches it."""
+        if not self.enabled or not client_id or frame_hash is None:
+            return None
+        entry = self._entries.get(client_id)
+        if entry is None:
+            return None
+        cached_hash, stored_at, response = entry
+        if time.monotonic() - stored_at > self.ttl:
+            return None
+        if (cached_hash ^ frame_hash).bit_count() > self.max_distance:
+            return None
+        return response
+
+    def put(self, client_id: str | None, frame_hash: int | None, response: dict):
+        if not self.enabled or not client_id or frame_hash is None:
+            return
+        self._entries[client_id] = (frame_hash, time.monotonic(), response)
+        self._entries.move_to_end(client_id)
+        if len(self._entries) > _MAX_CLIENTS:
+            self._entries.popitem(last=False)
@@ -3,13 +3,63 @@ Priority engine – picks the most important object and generates
 safety alerts for the spoken / haptic feedback layer.
 """
 
-from app.config import settings
+from dataclasses import dataclass
 
+import numpy as np
 
-def pick_priority_object(detection_results: list[dict]) -> dict:
+from app.config import CRITICAL_OBJECTS, HAZARD_OBJECTS, settings
+
+
+@dataclass(slots=True)
+class DetectionResult:
+    label: str
+    label_id: int                     # YOLO class id (-1 for the "No object" placeholder)
+    confidence: float
+    bbox: tuple[int, int, int, int]   # x1, y1, x2, y2
+    distance: float                   # metres, 0.0 when unknown
+
+    def as_response(self) -> dict:
+        """JSON shape of one entry in the response's `detections` list."""
+        return {
+            "label": self.label,
+            "confidence": self.confidence,
+            "bbox": self.bbox,  # orjson writes tuples as JSON arrays
+            "distance": self.distance,
+        }
+
+
+_NO_OBJECT = DetectionResult(
+    label="No object", label_id=-1, confidence=0.0, bbox=(0, 0, 0, 0), distance=0.0
+)
+
+# Alert templates, indexed by the rule `generate_alerts` selects per detection
+_ALERT_TEMPLATES: tuple[str, ...] = (
+    "⚠️ {label} very close – {dist:.1f}m",  # critical, very close
+    "⚠️ {label} in path – {dist:.1f}m",     # hazard, very close
+    "{label} very close – {dist:.1f}m",     # anything else, very close
+    "{label} nearby – {dist:.1f}m",         # critical, close
+)
+
+
+def _tier_flags(detection_results: list[DetectionResult], tier: frozenset[str], flags) -> list:
+    """Per-detection tier membership: precomputed `flags` or a label lookup."""
+    if flags is not None:
+        return flags
+    return [d.label in tier for d in detection_results]
+
+
+def pick_priority_object(
+    detection_results: list[DetectionResult],
+    critical=None,
+    hazard=None,
+) -> DetectionResult:
     """
     Choose the single most important detection.
 
+    `critical` / `hazard` are optional per-detection booleans (e.g. from
+    the detector's class-id indexed tables); when omitted they are looked
+    up from the configured label sets.
+
     Priority order:
       1. Tier-1 CRITICAL objects (vehicles, weapons, dangerous animals) – closest first.
       2. Tier-2 HAZARD objects that are very close (< DISTANCE_CLOSE) – closest first.
@@ -17,21 +67,22 @@ def pick_priority_object(detection_results: list[dict]) -> dict:
       4. Fallback "No object" if nothing detected.
     """
     if not detection_results:
-        return {"label": "No object", "distance": 0.0}
+        return _NO_OBJECT
 
-    def sort_key(d: dict) -> float:
-        return d["distance"] if d["distance"] > 0 else 999.0
+    def sort_key(d: DetectionResult) -> float:
+        return d.distance if d.distance > 0 else 999.0
 
     # Tier 1: always-critical regardless of distance
-    critical = [d for d in detection_results if d["label"] in settings.CRITICAL_OBJECTS]
-    if critical:
-        return min(critical, key=sort_key)
+    critical = _tier_flags(detection_results, CRITICAL_OBJECTS, critical)
+    critical_objects = [d for d, is_crit in zip(detection_results, critical) if is_crit]
+    if critical_objects:
+        return min(critical_objects, key=sort_key)
 
     # Tier 2: hazard objects elevated only when close
+    hazard = _tier_flags(detection_results, HAZARD_OBJECTS, hazard)
     hazards_close = [
-        d for d in detection_results
-        if d["label"] in settings.HAZARD_OBJECTS
-        and 0 < d["distance"] <= settings.DISTANCE_CLOSE
+        d for d, is_hazard in zip(detection_results, hazard)
+        if is_hazard and 0 < d.distance <= settings.DISTANCE_CLOSE
     ]
     if hazards_close:
         return min(hazards_close, key=sort_key)
@@ -40,31 +91,41 @@ def pick_priority_object(detection_results: list[dict]) -> dict:
     return min(detection_results, key=sort_key)
 
 
-def generate_alerts(detection_results: list[dict]) -> list[str]:
+def generate_alerts(
+    detection_results: list[DetectionResult],
+    critical=None,
+    hazard=None,
+) -> list[str]:
     """
     Generate safety alert strings for objects that are dangerously close.
 
+    `critical` / `hazard` are optional per-detection booleans, as for
+    `pick_priority_object`.
+
     Alert rules:
       - Any object within DISTANCE_VERY_CLOSE  → urgent warning.
       - Critical object within DISTANCE_CLOSE  → standard proximity warning.
       - Hazard object within DISTANCE_VERY_CLOSE → trip/collision warning.
     """
-    alerts: list[str] = []
-
-    for det in detection_results:
-        dist = det["distance"]
-        label = det["label"]
-        if dist <= 0:
-            continue
-
-        if dist <= settings.DISTANCE_VERY_CLOSE:
-            if label in settings.CRITICAL_OBJECTS:
-                alerts.append(f"⚠️ {label} very close – {dist:.1f}m")
-            elif label in settings.HAZARD_OBJECTS:
-                alerts.append(f"⚠️ {label} in path – {dist:.1f}m")
-            else:
-                alerts.append(f"{label} very close – {dist:.1f}m")
-        elif dist <= settings.DISTANCE_CLOSE and label in settings.CRITICAL_OBJECTS:
-            alerts.append(f"{label} nearby – {dist:.1f}m")
-
-    return alerts
+    if not detection_results:
+        return []
+
+    dist = np.array([d.distance for d in detection_results], dtype=np.float64)
+    is_crit = np.asarray(_tier_flags(detection_results, CRITICAL_OBJECTS, critical), dtype=bool)
+    is_hazard = np.asarray(_tier_flags(detection_results, HAZARD_OBJECTS, hazard), dtype=bool)
+
+    very_close = (dist > 0) & (dist <= settings.DISTANCE_VERY_CLOSE)
+    nearby = ~very_close & (dist > 0) & (dist <= settings.DISTANCE_CLOSE) & is_crit
+    rule = np.select(
+        [very_close & is_crit, very_close & is_hazard, very_close, nearby],
+        [0, 1, 2, 3],
+        default=-1,
+    )
+
+    # Only the (few) detections that trigger an alert get formatted
+    return [
+        _ALERT_TEMPLATES[rule[i]].format(
+            label=detection_results[i].label, dist=detection_results[i].distance
+        )
+        for i in np.flatnonzero(rule >= 0)
+    ]
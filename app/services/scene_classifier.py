@@ -27,21 +27,47 @@ _SCENE_RULES: list[tuple[set[str], str]] = [
 ]
 
 
+# Require at least 2 matches for multi-item rules,
+# or 1 if the rule itself has only 1 element
+_MIN_NEEDED: tuple[int, ...] = tuple(min(2, len(required)) for required, _ in _SCENE_RULES)
+
+# Every label mentioned by a rule gets one bit; a rule becomes the mask of
+# its labels and a frame's overlap with it is a single popcount.
+_LABEL_BITS: dict[str, int] = {
+    label: 1 << i
+    for i, label in enumerate(sorted(set().union(*(required for required, _ in _SCENE_RULES))))
+}
+_RULE_MASKS: tuple[int, ...] = tuple(
+    sum(_LABEL_BITS[label] for label in required) for required, _ in _SCENE_RULES
+)
+_RULE_SIZES: tuple[int, ...] = tuple(len(required) for required, _ in _SCENE_RULES)
+_RULE_NAMES: tuple[str, ...] = tuple(scene for _, scene in _SCENE_RULES)
+# Largest rule after each one: a complete match can only be outscored by a
+# later rule with more labels than it
+_LATER_MAX: tuple[int, ...] = tuple(max(_RULE_SIZES[i + 1:], default=0) for i in range(len(_RULE_SIZES)))
+_RULES = tuple(zip(_RULE_MASKS, _RULE_SIZES, _MIN_NEEDED, _LATER_MAX, _RULE_NAMES))
+
+
 def classify_scene(detections: list[Detection]) -> str:
     """Return the best-matching scene label for the set of detections."""
     if not detections:
         return "Unknown"
 
-    labels = {d.label for d in detections}
+    # Labels no rule mentions contribute no bits
+    labels_mask = 0
+    for d in detections:
+        labels_mask |= _LABEL_BITS.get(d.label, 0)
 
     best_match = "General area"
     best_overlap = 0
 
-    for required, scene in _SCENE_RULES:
-        overlap = len(labels & required)
-        # Require at least 2 matches for multi-item rules,
-        # or 1 if the rule itself has only 1 element
-        min_needed = min(2, len(required))
+    # The highest overlap wins and ties keep the earlier rule. A complete
+    # match that beats every earlier overlap and can't be outscored by any
+    # later rule is already the answer, so the scan stops there
+    for rule_mask, rule_size, min_needed, later_max, scene in _RULES:
+        overlap = (labels_mask & rule_mask).bit_count()
+        if overlap == rule_size and overlap > best_overlap and overlap >= later_max:
+            return scene
         if overlap >= min_needed and overlap > best_overlap:
             best_overlap = overlap
             best_match = scene